@@ -0,0 +1,104 @@
+#! /usr/bin/env python3
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Cold start benchmark of the ota command, for scripted use.
+#
+# Runs "python -X importtime -m ota <args>" for a few command lines that do
+# not reach the network, and checks that:
+# - the import time of each stays under the budget (--budget <ms>)
+# - none of them imports the heavy modules (requests, subprocess, sqlite3)
+# The import time only counts the modules the interpreter does not already
+# import on its own at startup (site, .pth hooks of installed packages...).
+#
+# Exits non-zero if a check fails, so it can run in CI:
+#   python3 benchmarks/startup_bench.py [--budget <ms>] [--runs <n>]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+COMMAND_LINES = [
+    ["-h"],
+    ["create-record", "-h"],
+    ["upload", "-h"],
+    ["batch", "-h"],
+    ["list", "-h"],
+    ["deploy", "-h"],
+]
+
+HEAVY_MODULES = ["requests", "subprocess", "sqlite3", "ota.ledger"]
+
+DEFAULT_BUDGET_MS = 20.0
+
+# exit (-10) of the usage of the commands
+USAGE_EXIT_CODE = -10 & 0xff
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(args, baseline=frozenset()):
+    """
+    Returns (wall clock ms, import ms, set of imported modules, exit code) of
+    one cold start, not counting the import time of the baseline modules.
+    """
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, PYTHONDONTWRITEBYTECODE="")
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + args,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          env=env, universal_newlines=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    # import time: self [us] | cumulative | imported package
+    import_us = 0
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if name not in baseline:
+            import_us += int(self_us)
+        modules.add(name)
+    return wall_ms, import_us / 1000.0, modules, proc.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_MS,
+                        help="import time budget of a command, in ms (default %(default)s)")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="runs per command line, the best one is kept (default %(default)s)")
+    opts = parser.parse_args()
+
+    # modules imported by the interpreter itself
+    baseline = frozenset(run(["-c", "pass"])[2])
+
+    failed = False
+    print("{0:<25}  {1:>10}  {2:>10}".format("command", "wall (ms)", "import (ms)"))
+    for args in COMMAND_LINES:
+        runs = [run(["-m", "ota"] + args, baseline) for i in range(opts.runs)]
+        wall_ms = min(r[0] for r in runs)
+        import_ms = min(r[1] for r in runs)
+        heavy = [m for m in HEAVY_MODULES if m in runs[0][2]]
+
+        status = ""
+        if runs[0][3] != USAGE_EXIT_CODE:
+            status += "  EXIT CODE {}".format(runs[0][3])
+        if import_ms > opts.budget:
+            status += "  OVER BUDGET"
+        if heavy:
+            status += "  imports {}".format(", ".join(heavy))
+        failed = failed or bool(status)
+
+        print("{0:<25}  {1:>10.1f}  {2:>10.1f}{3}".format("ota " + " ".join(args), wall_ms, import_ms, status))
+
+    print("\nbudget: {} ms of imports per command".format(opts.budget))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
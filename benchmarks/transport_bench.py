@@ -0,0 +1,238 @@
+#! /usr/bin/env python3
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# HTTP/1.1 vs HTTP/2 transport benchmark of deploy pushes.
+#
+# Starts a local TLS stand-in of the OTA service, which speaks h2 or
+# HTTP/1.1 as negotiated by ALPN and answers every request after a simulated
+# service latency, then pushes to --requests devices from --jobs threads
+# through ota.deploy.pushOTAImage with each transport, and reports the
+# requests/sec and the number of connections the stand-in accepted.
+#
+# The "HTTP/1.1 single" row is the transport of the tools before the shared
+# request layer: one requests call, so one TLS connection, per request.
+#
+# Needs httpx[http2] and the openssl command (for the stand-in certificate):
+#   python3 benchmarks/transport_bench.py [--requests <n>] [--jobs <n>] [--latency <ms>]
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import h2.config
+import h2.connection
+import h2.events
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ota import core
+from ota import deploy
+
+
+class StandIn(object):
+    """
+    Local stand-in of the OTA service, run in its own process so that it does
+    not compete with the client for the interpreter.  The connections it
+    accepts are counted by protocol in shared memory.
+    """
+
+    PROTOCOLS = ("h2", "http/1.1")
+
+    def __init__(self, certfile, keyfile, latency):
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.latency = latency
+        self.counters = dict((p, multiprocessing.Value("i", 0)) for p in self.PROTOCOLS)
+        self.process = None
+        self.port = None
+
+    def start(self):
+        ports = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=self.run, args=(ports,))
+        self.process.daemon = True
+        self.process.start()
+        self.port = ports.get()
+
+    def run(self, ports):
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(self.certfile, self.keyfile)
+        context.set_alpn_protocols(list(self.PROTOCOLS))
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_server(self.handle, "127.0.0.1", 0, ssl=context))
+        ports.put(server.sockets[0].getsockname()[1])
+        loop.run_forever()
+
+    def connections(self):
+        return dict((p, c.value) for p, c in self.counters.items() if c.value)
+
+    def reset(self):
+        for counter in self.counters.values():
+            counter.value = 0
+
+    def response(self, method):
+        if method == "PUT":
+            return 202, b"{}"
+        return 200, b'{"value": true}'
+
+    async def handle(self, reader, writer):
+        protocol = writer.get_extra_info("ssl_object").selected_alpn_protocol() or "http/1.1"
+        with self.counters[protocol].get_lock():
+            self.counters[protocol].value += 1
+        try:
+            if protocol == "h2":
+                await self.serveH2(reader, writer)
+            else:
+                await self.serveH1(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        writer.close()
+
+    async def serveH1(self, reader, writer):
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, value = line.decode("latin-1").split(":", 1)
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            if length:
+                await reader.readexactly(length)
+
+            await asyncio.sleep(self.latency)
+            status, body = self.response(request_line.split()[0].decode())
+            writer.write("HTTP/1.1 {} OK\r\nContent-Type: application/json\r\n"
+                         "Content-Length: {}\r\n\r\n".format(status, len(body)).encode() + body)
+            await writer.drain()
+
+    async def serveH2(self, reader, writer):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        methods = {}
+
+        async def respond(stream_id, method):
+            await asyncio.sleep(self.latency)
+            status, body = self.response(method)
+            conn.send_headers(stream_id, [(":status", str(status)),
+                                          ("content-type", "application/json"),
+                                          ("content-length", str(len(body)))])
+            conn.send_data(stream_id, body, end_stream=True)
+            writer.write(conn.data_to_send())
+
+        while True:
+            data = await reader.read(65535)
+            if not data:
+                return
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    methods[event.stream_id] = dict(event.headers)[b":method"].decode()
+                elif isinstance(event, h2.events.DataReceived):
+                    conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    asyncio.ensure_future(respond(event.stream_id, methods.pop(event.stream_id)))
+            writer.write(conn.data_to_send())
+            await writer.drain()
+
+
+def makeCertificate(directory):
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                           "-keyout", keyfile, "-out", certfile, "-days", "1",
+                           "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def pushAll(requests, jobs):
+    devices = iter(range(requests))
+    lock = threading.Lock()
+    failures = []
+
+    def worker():
+        while True:
+            with lock:
+                device = next(devices, None)
+            if device is None:
+                return
+            status = deploy.pushOTAImage("device-{}".format(device)).status_code
+            if status != 202:
+                failures.append(status)
+
+    threads = [threading.Thread(target=worker) for i in range(jobs)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/1.1 vs HTTP/2 deploy push benchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="pushes per transport (default %(default)s)")
+    parser.add_argument("--jobs", type=int, default=32, help="concurrent pushes (default %(default)s)")
+    parser.add_argument("--latency", type=float, default=5.0,
+                        help="simulated service latency in ms (default %(default)s)")
+    opts = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        certfile, keyfile = makeCertificate(directory)
+        # trust the stand-in certificate, in requests and in httpx
+        os.environ["REQUESTS_CA_BUNDLE"] = certfile
+        os.environ["SSL_CERT_FILE"] = certfile
+
+        standIn = StandIn(certfile, keyfile, opts.latency / 1000.0)
+        standIn.start()
+
+        deploy.OTA_SERVICE_HOST_URL = "https://localhost:{}".format(standIn.port)
+        deploy.commonConfig = { "partnerId": "partner", "deviceTypeId": "deviceType" }
+        deploy.access_token = "token"
+        deploy.imageId = 1
+
+        print("{} pushes, {} jobs, {} ms service latency\n".format(opts.requests, opts.jobs, opts.latency))
+        print("{0:<16}  {1:>10}  {2:>12}  {3}".format("transport", "req/s", "connections", "protocols"))
+        transports = (("HTTP/1.1 single", False, False),
+                      ("HTTP/1.1", False, True),
+                      ("HTTP/2", True, True))
+        for name, http2, pooled in transports:
+            core.configureTransport(http2, opts.jobs)
+            standIn.reset()
+            if pooled:
+                elapsed, failures = pushAll(opts.requests, opts.jobs)
+            else:
+                import requests
+                pooled_request = core.request
+                core.request = requests.request
+                try:
+                    elapsed, failures = pushAll(opts.requests, opts.jobs)
+                finally:
+                    core.request = pooled_request
+            connections = standIn.connections()
+            protocols = ", ".join("{} {}".format(n, p) for p, n in sorted(connections.items()))
+            print("{0:<16}  {1:>10.0f}  {2:>12}  {3}".format(
+                  name, opts.requests / elapsed, sum(connections.values()), protocols))
+            if failures:
+                print("  {} failed pushes".format(len(failures)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Afero partner hub OTA tools.
+#
+# Nothing is imported here: every "ota" command loads this package, and only
+# needs the modules of that command.
+
+__version__ = "1.1.0"
@@ -0,0 +1,8 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# python -m ota <command> [options]
+
+from ota.cli import main
+
+main()
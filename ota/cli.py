@@ -0,0 +1,64 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# ota: single entry point of the partner hub OTA tools.
+#
+#   ota <command> [options]
+#
+# Only the module of the command being run is imported, and the HTTP library
+# only once a request is made, so "ota -h" and "ota <command> -h" start fast.
+# Keep the imports of this module to the bare minimum.
+
+from __future__ import print_function
+
+import importlib
+import sys
+
+
+#
+# command -> (module, entry point, options passed ahead of the command line,
+#             description)
+#
+COMMANDS = [
+    ("create-record", "ota.uploader", "main",         ["--createOTARecord"],
+     "create the OTA record for a build"),
+    ("upload",        "ota.uploader", "main",         ["--uploadOTAImage"],
+     "upload & associate the OTA image(s) of a created record"),
+    ("batch",         "ota.uploader", "batchCommand", [],
+     "create, upload & associate every release of a manifest"),
+    ("list",          "ota.deploy",   "main",         ["--list"],
+     "list the OTA images of the partner and deviceType"),
+    ("deploy",        "ota.deploy",   "main",         [],
+     "deploy an OTA image to a device or a list of devices"),
+]
+
+
+def usage():
+    prog = "ota"
+    print(prog + " [-h] <command> [options]")
+    print("")
+    for name, module, entry, opts, description in COMMANDS:
+        print("\t{0:<15}: {1}".format(name, description))
+    print("")
+    print("\t" + prog + " <command> -h for the options of a command")
+    exit (-10)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if not argv or argv[0] in ("-h", "--help"):
+        usage()
+
+    for name, module, entry, opts, description in COMMANDS:
+        if argv[0] == name:
+            getattr(importlib.import_module(module), entry)(opts + argv[1:], "ota " + name)
+            return
+
+    print("Unknown command: {}".format(argv[0]))
+    usage()
+
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,186 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Shared core of the partner hub OTA tools: configuration, authentication
+# and the request layer used to talk to the OTA service.
+#
+# Firmware type defined in the OTA Service supported by these tools:
+# - Hub (Attribute ID 2005, Type 5)
+# - service: on prod
+#
+# Keep the imports of this module light: it is loaded by every ota command,
+# including "-h".  The HTTP library is only imported on the first request.
+
+from __future__ import print_function
+
+import json
+import os
+import threading
+import time
+
+
+OTA_SERVICE_HOST_URL="https://api.afero.io"
+
+OTA_IMAGE_TYPE = 5
+
+#
+# Default configuration file: can be changed using --conf <file>
+#
+DEFAULT_CONFIG_FILE = "partner-ota-conf.json"
+
+
+#
+# Transport of the requests to the OTA service:
+# - HTTP/1.1 through requests (default), over a pool of kept-alive connections
+# - HTTP/2 through httpx (Python 3, pip install httpx[http2]) with
+#   configureTransport(http2=True), see ota/http2.py: concurrent requests are
+#   multiplexed as streams over a few connections.  Falls back to HTTP/1.1 if
+#   httpx is not installed or the server does not negotiate h2.
+# The transport is created on the first request of each process.
+#
+_http2 = False
+_maxConnections = 10
+_transport = None
+_transportPid = None
+_transportLock = threading.Lock()
+
+
+class Http1Transport(object):
+    def __init__(self, maxConnections):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=maxConnections)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.exceptions = (requests.exceptions.RequestException,)
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+
+def configureTransport(http2=False, maxConnections=10):
+    """
+    Selects the transport of the following requests.  maxConnections should
+    be at least the number of requests made concurrently over HTTP/1.1.
+    """
+    global _http2
+    global _maxConnections
+    global _transport
+
+    _http2 = http2
+    _maxConnections = maxConnections
+    _transport = None
+
+
+def _getTransport():
+    global _http2
+    global _transport
+    global _transportPid
+
+    with _transportLock:
+        # connections are not shared with forked deploy processes
+        if _transport is None or _transportPid != os.getpid():
+            _transport = None
+            if _http2:
+                try:
+                    # ImportError without httpx or h2, SyntaxError on Python 2
+                    from ota.http2 import Http2Transport
+                    _transport = Http2Transport(_maxConnections)
+                except (ImportError, SyntaxError):
+                    print("HTTP/2 needs Python 3 and httpx[http2] (pip install httpx[http2]), using HTTP/1.1")
+                    _http2 = False
+            if _transport is None:
+                _transport = Http1Transport(_maxConnections)
+            _transportPid = os.getpid()
+        return _transport
+
+
+def request(method, url, **kwargs):
+    """
+    Sends a request to the OTA service and returns the response, which has
+    status_code, text and json().
+    """
+    return _getTransport().request(method, url, **kwargs)
+
+
+def requestExceptions():
+    """Returns the exception classes raised by request() on transport errors."""
+    return _getTransport().exceptions
+
+
+def getMillisTimestamp():
+    return int(round(time.time() * 1000))
+
+
+# load the configuration json file
+def loadCommonConfig(configFile):
+    with open(configFile) as data_file:
+        commonConfig = json.load(data_file)
+
+    ts = getMillisTimestamp()
+    commonConfig["createdTimestamp"] = ts
+    commonConfig["updatedTimestamp"] = ts
+
+    return commonConfig
+
+
+# Request an access token for a given user
+def getAccessToken(commonConfig):
+    url = "{}/oauth/token".format(OTA_SERVICE_HOST_URL)
+    headers={ "Content-Type": "application/x-www-form-urlencoded",
+              "Accept": "application/json",
+              "Authorization": "Basic {}".format(commonConfig["auth-string"])
+            }
+    payload = {"username": str(commonConfig["username"]),
+               "password": str(commonConfig["userpw"]),
+               "grant_type": 'password'}
+
+    response = request("POST", url,
+                       data=payload,
+                       headers=headers,
+                       timeout=None)
+    jresp = response.json()
+    if response.status_code == 200:
+        access_token = jresp.get('access_token')
+        print("Got access_token: {}".format(access_token))
+        return access_token
+    else:
+        print("Bad response for token access \n")
+        print("error_code:{} - {}".format(jresp["status"], jresp["error"]))
+        exit (-9)
+
+
+def otaRecordForDeviceTypeExists(commonConfig, access_token):
+    print("Check for existence -> \n")
+
+    url="{}/v1/ota/partners/{}/pool/types/{}/names/{}/versions/{}/exists".format(
+        OTA_SERVICE_HOST_URL,
+        commonConfig["partnerId"],
+        OTA_IMAGE_TYPE,
+        commonConfig["name"],
+        commonConfig["version"]
+    )
+    headers={
+              "Accept": "application/json",
+              "Authorization": "Bearer {}".format(access_token)
+            }
+    response = request("GET", url, headers=headers)
+    ret_val = response.json()
+    if (response.status_code == 200):
+        return (ret_val['value'])
+    else:
+        if (response.status_code == 401):
+            print("Unauthorized request")
+        else:
+            print("Bad response ({}) from {}".format(response.status_code, url))
+            print_err_response(response.json())
+
+        exit (-1)
+
+
+def print_err_response(jresp):
+    print("    \t")
+    ret_text = jresp["trace"]
+    print(ret_text.split("at", 1)[0])
@@ -0,0 +1,618 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Deploying an OTA image to devices, and listing the OTA images.
+#
+# Firmware type defined in the OTA Service supported by this tool:
+# - Hub (Attribute ID 2005, Type 5)
+# - service: on prod
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import getopt
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ota import core
+from ota import profiling
+from ota.core import OTA_SERVICE_HOST_URL, OTA_IMAGE_TYPE
+
+
+commonConfig = []
+access_token = None
+deviceId  = None
+imageId   = None
+listFlag  = False
+devicesFile = None
+deployJobs  = 8
+
+# --http2: HTTP/2 transport to the OTA service, see ota/core.py
+http2Flag = False
+
+# --profile <dir>: profiles of the phases, see ota/profiling.py
+profileDir = None
+
+# program name in the usage, "ota <command>" when run by ota/cli.py
+progName = os.path.basename(sys.argv[0])
+
+#
+# Push ledger: records which devices already accepted which image, so a
+# retried or extended deploy does not push them again.
+# - ledgerFile : can be changed using --ledger <file>
+# - forcePush  : --force re-pushes devices found in the ledger
+# - expireDays : --expire <days> drops ledger entries older than <days>
+# - bloomFlag  : --bloom checks a Bloom filter (<ledgerFile>.bloom) before the ledger
+#
+ledgerFile = "partner-ota-push-ledger.db"
+forcePush  = False
+expireDays = None
+bloomFlag  = False
+
+# ledger commits of the last deployShard(), see PushLedger.stampBloom()
+ledgerCommits = 0
+
+# number of device ids read, filtered against the ledger and pushed at a time
+LEDGER_CHUNK_SIZE = 1000
+
+#
+# Sharded deploys: the devices of the list are split by consistent hashing.
+# - --shard <i>/<K> : only deploy shard i (0..K-1) of K, e.g. one per runner host
+# - --processes <P> : split the (shard of the) list again between P local processes
+# Each process writes the results of its devices, one json object per line, to
+# resultsFile (--results <file>) suffixed with its shard; the files of the
+# processes are merged at the end, and the files of the hosts can be merged
+# with --merge <file> <shard results files...>.
+#
+shardIndex      = 0
+shardCount      = 1
+deployProcesses = 1
+processIndex    = 0
+resultsFile     = "partner-ota-deploy-results.jsonl"
+mergeFile       = None
+
+#
+# Default configuration file: can be changed using --conf <file> option
+#
+configFile = core.DEFAULT_CONFIG_FILE
+
+
+def listOTAImages():
+    url="{}/v1/ota/partners/{}/deviceTypes/{}/firmwareImages/types/{}".format(
+                                                     OTA_SERVICE_HOST_URL,
+                                                     commonConfig["partnerId"],
+                                                     commonConfig["deviceTypeId"],
+                                                     OTA_IMAGE_TYPE)
+    headers={
+              "Accept": "application/json",
+              "Authorization": "Bearer {}".format(access_token)
+            }
+
+    response = core.request("GET", url, headers=headers)
+    ret_val = response.json()
+    if (response.status_code == 200):
+        content = ret_val['content']
+        print("\n----  List of HUB FULL OTA images ---- \n")
+        print("partnerId   : {}".format(commonConfig["partnerId"]))
+        print("deviceTypeId: {}\n".format(commonConfig["deviceTypeId"]))
+
+        print("Total Number of Images: {}".format(ret_val['totalElements']))
+        print("{0:<10}  {1:<15}  {2:<30}  {3:<30}".format("Image Id", "Version", "Name", "Description"))
+        print("{0:<10}  {1:<15}  {2:<30}  {3:<30}".format("-" * 10, "-" * 15 , "-" * 30, "-" * 30))
+
+        for page in range (0, ret_val['totalPages']):
+            for ele in range (0, ret_val['totalElements']):
+                record = content[ele]
+                print("{0:<10}  {1:<15}  {2:<30}  {3:<30}".format(
+                      record['id'], record['version'], record['name'], record['description']))
+    else:
+        if (response.status_code == 401):
+            print("Unauthorized request")
+        else:
+            print("Bad response ({}) from {}".format(response.status_code, url))
+
+        core.print_err_response(response.json())
+        exit (-2)
+
+
+def openPushLedger():
+    from ota.ledger import PushLedger
+
+    ledger = PushLedger(ledgerFile, bloomFlag)
+    if expireDays is not None:
+        expired = ledger.expire(expireDays)
+        print("Expired {} push ledger entries older than {} days".format(expired, expireDays))
+    return ledger
+
+
+def pushOTAImage(device):
+    """
+    PUT /v1/ota/partners/{partnerId}/deviceTypes/{deviceTypeId}/firmwareImages/{imageId}/push
+    - Requests the OTA service to push the image to the device
+    """
+    url="{}/v1/ota/partners/{}/deviceTypes/{}/firmwareImages/{}/push".format(
+               OTA_SERVICE_HOST_URL,
+               commonConfig["partnerId"],
+               commonConfig["deviceTypeId"],
+               imageId
+               )
+    headers={
+              "Accept": "application/json",
+              "Authorization": "Bearer {}".format(access_token)
+            }
+    payload={
+              "value": device
+            }
+
+    return core.request("PUT", url,
+                        headers=headers,
+                        json=payload,
+                        timeout=None)
+
+
+def deployOTAImage(ledger):
+    from ota.ledger import PUSH_ACCEPTED
+
+    accepted_ts = ledger.accepted(imageId, deviceId)
+    if (accepted_ts != None) and (forcePush == False):
+        print("Device {} already accepted image {} at {}, skipping (use --force to push again)".format(
+              deviceId, imageId, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(accepted_ts / 1000))))
+        return
+
+    response = pushOTAImage(deviceId)
+    ledger.record(imageId, deviceId, response.status_code)
+    ledger.commit()
+
+    if (response.status_code == PUSH_ACCEPTED):
+        print("\nRequest accepted for processing\n")
+    else:
+        if (response.status_code == 401):
+            print("Unauthorized request")
+        else:
+            print("Bad response ({}) for device {}".format(response.status_code, deviceId))
+            core.print_err_response(response.json())
+
+        exit (-3)
+
+
+def inShard(device):
+    from ota.shard import deviceShard
+
+    if shardCount > 1 and deviceShard(device, shardCount) != shardIndex:
+        return False
+    if deployProcesses > 1 and deviceShard(device, deployProcesses, "process:") != processIndex:
+        return False
+    return True
+
+
+def readDeviceIds(filename):
+    """
+    Reads the device ids file (one deviceId per line, '#' comments allowed)
+    in chunks of LEDGER_CHUNK_SIZE, so any number of devices can be deployed.
+    Only the devices of this shard and process are returned.
+    """
+    sharded = shardCount > 1 or deployProcesses > 1
+    chunk = []
+    with open(filename) as devices_file:
+        for line in devices_file:
+            device = line.split("#", 1)[0].strip()
+            if device and (not sharded or inShard(device)):
+                chunk.append(device)
+                if len(chunk) == LEDGER_CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def writeResult(results_file, device, result, status=None):
+    line = { "deviceId": device, "imageId": imageId, "result": result }
+    if status is not None:
+        line["status"] = status
+    results_file.write(json.dumps(line, sort_keys=True) + "\n")
+
+
+def deployOTAImages(ledger, results_file):
+    """
+    Pushes the image to every device of devicesFile (of this shard) that did
+    not accept it yet, using deployJobs worker threads.  The devices found in
+    the ledger are filtered out before any request is made, unless --force is
+    given.
+
+    The workers only make the requests; the results are written to the ledger
+    and to results_file by this thread, a chunk at a time.
+
+    Returns the number of devices accepted, failed and skipped.
+    """
+    from ota.ledger import PUSH_ACCEPTED
+
+    work = queue.Queue(maxsize=deployJobs * 4)
+    results = queue.Queue()
+
+    def worker():
+        # one profiled phase per worker rather than per push, which would
+        # cost more than the push itself
+        with profiling.phase("deployOTAImage"):
+            while True:
+                device = work.get()
+                if device is None:
+                    return
+                # any error counts the device as failed: a worker that died
+                # without a result would leave the deploy waiting forever
+                try:
+                    status = pushOTAImage(device).status_code
+                except Exception as e:
+                    print("Push to device {} failed: {}: {}".format(device, type(e).__name__, e))
+                    status = 0
+                results.put((device, status))
+
+    workers = [threading.Thread(target=worker) for i in range(deployJobs)]
+    for t in workers:
+        t.daemon = True
+        t.start()
+
+    counts = { "accepted": 0, "failed": 0, "skipped": 0 }
+
+    def recordResults(block):
+        while True:
+            try:
+                device, status = results.get(block)
+            except queue.Empty:
+                return
+            ledger.record(imageId, device, status)
+            if status == PUSH_ACCEPTED:
+                counts["accepted"] += 1
+                writeResult(results_file, device, "accepted", status)
+            else:
+                counts["failed"] += 1
+                writeResult(results_file, device, "failed", status)
+                if status != 0:
+                    print("Bad response ({}) for device {}".format(status, device))
+            if block:
+                return
+
+    pending = 0
+    for chunk in readDeviceIds(devicesFile):
+        with profiling.phase("pushLedger"):
+            if forcePush == True:
+                todo = chunk
+            else:
+                todo = ledger.notAccepted(imageId, chunk)
+
+            if len(todo) != len(chunk):
+                todo_set = set(todo)
+                for device in chunk:
+                    if device not in todo_set:
+                        writeResult(results_file, device, "skipped")
+                counts["skipped"] += len(chunk) - len(todo)
+
+        for device in todo:
+            work.put(device)
+        pending += len(todo)
+        while pending > deployJobs * 4:
+            recordResults(True)
+            pending -= 1
+        with profiling.phase("pushLedger"):
+            ledger.commit()
+
+    for t in workers:
+        work.put(None)
+    for t in workers:
+        t.join()
+    recordResults(False)
+    ledger.commit()
+
+    return counts
+
+
+def printCounts(counts):
+    print("\nAccepted: {}, failed: {}, skipped (already accepted): {}".format(
+          counts["accepted"], counts["failed"], counts["skipped"]))
+
+
+def shardResultsFile():
+    from ota.shard import shardFileName
+
+    filename = resultsFile
+    if shardCount > 1:
+        filename = shardFileName(filename, shardIndex, shardCount)
+    return filename
+
+
+def deployShard():
+    """Deploys the devices of this shard and process, and returns the counts."""
+    from ota.shard import shardFileName
+    global ledgerCommits
+
+    filename = shardResultsFile()
+    if deployProcesses > 1:
+        filename = shardFileName(filename, processIndex, deployProcesses)
+
+    ledger = openPushLedger()
+    try:
+        with open(filename, 'w') as results_file:
+            return deployOTAImages(ledger, results_file)
+    finally:
+        ledger.close()
+        ledgerCommits = ledger.commits
+
+
+def deployProcess(settings, index, commits):
+    """
+    Entry point of the processes of a --processes deploy.  Adds its ledger
+    commits to the shared commits value.
+    """
+    global processIndex
+
+    globals().update(settings)
+    processIndex = index
+    if profileDir:
+        profiling.enable(os.path.join(profileDir, "process-{}".format(index)))
+    core.configureTransport(http2Flag, deployJobs)
+    printCounts(deployShard())
+    with commits.get_lock():
+        commits.value += ledgerCommits
+    # the processes exit without running the atexit handlers
+    profiling.finish()
+
+
+def deployOTAImagesSharded():
+    """
+    Deploys this shard of the devices with deployProcesses processes, then
+    merges the results files of the processes.  Every process reads the whole
+    device list and keeps its own devices, so its memory does not depend on
+    the number of devices.
+    """
+    import multiprocessing
+    from ota.shard import shardFileName
+    global expireDays
+
+    bloomSync = None
+    if expireDays is not None or bloomFlag:
+        # expire, and check or rebuild the Bloom filter, once here rather
+        # than in every process
+        ledger = openPushLedger()
+        if bloomFlag:
+            bloomSync = (ledger.generation(), (ledger.bloom.nbits, ledger.bloom.nhashes))
+        ledger.close()
+        expireDays = None
+
+    settings = dict((name, globals()[name]) for name in
+                    ("commonConfig", "access_token", "imageId", "devicesFile", "deployJobs",
+                     "ledgerFile", "forcePush", "expireDays", "bloomFlag",
+                     "shardIndex", "shardCount", "deployProcesses", "resultsFile", "http2Flag",
+                     "profileDir"))
+    commits = multiprocessing.Value("i", 0)
+    processes = [multiprocessing.Process(target=deployProcess, args=(settings, i, commits))
+                 for i in range(deployProcesses)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    failed = [str(i) for i, p in enumerate(processes) if p.exitcode != 0]
+    if failed:
+        print("Deploy process(es) {} did not complete".format(", ".join(failed)))
+    elif bloomSync is not None:
+        # every process committed in turn, so each one left the filter it
+        # saved at an older generation than the ledger's
+        from ota.ledger import PushLedger
+        ledger = PushLedger(ledgerFile)
+        try:
+            ledger.stampBloom(bloomSync[0], commits.value, bloomSync[1])
+        finally:
+            ledger.close()
+
+    # a process that failed early, e.g. on the ledger lock, has no results file
+    filenames = []
+    for i in range(deployProcesses):
+        filename = shardFileName(shardResultsFile(), i, deployProcesses)
+        if os.path.exists(filename):
+            filenames.append(filename)
+        else:
+            print("No results from deploy process {}".format(i))
+    counts = mergeResults(shardResultsFile(), filenames)
+    for filename in filenames:
+        os.remove(filename)
+
+    if failed:
+        exit (-5)
+    return counts
+
+
+def mergeResults(filename, shardFiles):
+    """
+    Merges the results files of the shards into filename, and returns the
+    number of devices accepted, failed and skipped.  The files are streamed,
+    a line at a time.
+    """
+    counts = { "accepted": 0, "failed": 0, "skipped": 0 }
+    with open(filename, 'w') as merged_file:
+        for shardFile in shardFiles:
+            with open(shardFile) as results_file:
+                for line in results_file:
+                    counts[json.loads(line)["result"]] += 1
+                    merged_file.write(line)
+    print("Results of {} shard(s) merged to: {}".format(len(shardFiles), filename))
+    return counts
+
+
+def usage():
+    print(progName + " [-h] [-c <config_file>] -d <deviceId> -i <imageId> ")
+    print(progName + " [-h] [-c <config_file>] [-j <jobs>] -f <devices_file> -i <imageId> ")
+    print("\t-h           : help")
+    print("\t-c  --conf   : path and name of the configuration file")
+    print("\t-l  --list   : list the OTA images for the partner and deviceType only, without deploying")
+    print("\t-d  --device : deviceId of the device receiving the OTA image")
+    print("\t-f  --devices: file with the deviceIds (one per line) receiving the OTA image")
+    print("\t-j  --jobs   : number of concurrent pushes with --devices (default {})".format(deployJobs))
+    print("\t-i  --imageId: unique numerical Id for the uploaded OTA Image")
+    print("\t    --ledger : push ledger file (default {})".format(ledgerFile))
+    print("\t    --force  : push again to devices the ledger has as already accepted")
+    print("\t    --expire : drop push ledger entries older than <days> first")
+    print("\t    --bloom  : check a Bloom filter before the push ledger (large ledgers)")
+    print("\t    --shard  : <i>/<K>, deploy only shard i (0..K-1) of K of the devices file")
+    print("\t-P  --processes: number of processes the devices (of the shard) are split between")
+    print("\t    --results: devices file deploy results (default {})".format(resultsFile))
+    print("\t    --merge  : <file> <results files...>, merge the results of the shards into <file>")
+    print("\t    --http2  : use HTTP/2 to the OTA service (needs httpx[http2])")
+    print("\t    --profile: write CPU and memory profiles of the phases to <dir>")
+    exit (-10)
+
+
+def parseArgs(argv):
+    global configFile
+    global listFlag
+    global deviceId
+    global imageId
+    global devicesFile
+    global deployJobs
+    global ledgerFile
+    global forcePush
+    global expireDays
+    global bloomFlag
+    global shardIndex
+    global shardCount
+    global deployProcesses
+    global resultsFile
+    global mergeFile
+    global http2Flag
+    global profileDir
+
+    opts = ""
+
+    try:
+        opts, args = getopt.getopt(argv, "hd:c:i:lf:j:P:", ["conf=", "device=", "imageId=", "list",
+                                                            "devices=", "jobs=", "ledger=", "force",
+                                                            "expire=", "bloom", "shard=", "processes=",
+                                                            "results=", "merge=", "http2", "profile="])
+    except getopt.GetoptError:
+        usage()
+
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+        elif opt in ("-c", "--conf"):
+            configFile = arg
+        elif opt in ("-l", "--list"):
+            listFlag = True
+        elif opt in ("-d", "--device"):
+            deviceId=arg
+        elif opt in ("-i", "--imageId"):
+            imageId = int(arg)
+        elif opt in ("-f", "--devices"):
+            devicesFile = arg
+        elif opt in ("-j", "--jobs"):
+            try:
+                deployJobs = int(arg)
+            except ValueError:
+                usage()
+            if deployJobs < 1:
+                usage()
+        elif opt == "--ledger":
+            ledgerFile = arg
+        elif opt == "--force":
+            forcePush = True
+        elif opt == "--expire":
+            try:
+                expireDays = float(arg)
+            except ValueError:
+                usage()
+        elif opt == "--bloom":
+            bloomFlag = True
+        elif opt == "--shard":
+            from ota.shard import parseShard
+            try:
+                shardIndex, shardCount = parseShard(arg)
+            except ValueError:
+                usage()
+        elif opt in ("-P", "--processes"):
+            try:
+                deployProcesses = int(arg)
+            except ValueError:
+                usage()
+            if deployProcesses < 1:
+                usage()
+        elif opt == "--results":
+            resultsFile = arg
+        elif opt == "--merge":
+            mergeFile = arg
+        elif opt == "--http2":
+            http2Flag = True
+        elif opt == "--profile":
+            profileDir = arg
+        else:
+            usage()
+
+    return args
+
+
+def main(argv, prog=None):
+    global commonConfig
+    global access_token
+    global progName
+
+    if prog:
+        progName = prog
+
+    args = parseArgs(argv)
+
+    if profileDir:
+        profiling.enable(profileDir)
+
+    if mergeFile:
+        if not args:
+            print("No results files to merge")
+            usage()
+        counts = mergeResults(mergeFile, args)
+        printCounts(counts)
+        if counts["failed"]:
+            exit (-4)
+        return
+
+    if (not deviceId) and (not devicesFile) and (listFlag == False):
+        print("Device Id is required for OTA delopyment")
+        usage()
+
+    commonConfig = core.loadCommonConfig(configFile)
+
+    core.configureTransport(http2Flag, deployJobs)
+
+    access_token = core.getAccessToken(commonConfig)
+
+
+    if listFlag == True:
+        with profiling.phase("listOTAImages"):
+            listOTAImages()
+    else:
+        if (devicesFile != None) and (imageId != None):
+                print("Initiate OTA Image deploying to the devices in {} ..... ".format(devicesFile))
+                if deployProcesses > 1:
+                    counts = deployOTAImagesSharded()
+                else:
+                    counts = deployShard()
+                    print("Results output to: {}".format(shardResultsFile()))
+                printCounts(counts)
+                if counts["failed"]:
+                    exit (-4)
+        elif (deviceId != None) and (imageId != None):
+                print("Initiate OTA Image deploying ..... ")
+                ledger = openPushLedger()
+                try:
+                    with profiling.phase("deployOTAImage"):
+                        deployOTAImage(ledger)
+                finally:
+                    ledger.close()
+        else:
+           print ("Please specify deviceId and imageId for OTA deployment")
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
@@ -0,0 +1,58 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# HTTP/2 transport of the requests to the OTA service (Python 3, httpx[http2]).
+#
+# The requests of all the threads of a process are multiplexed as streams over
+# a few connections.  The httpx client runs on its own event loop thread: the
+# synchronous httpx client is not safe to share between threads over HTTP/2,
+# its threads can send the headers of new streams out of order.
+
+import asyncio
+import os
+import threading
+
+import httpx
+
+
+# size of the chunks of uploaded files
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+async def _readChunks(file):
+    while True:
+        chunk = file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+class Http2Transport(object):
+    def __init__(self, maxConnections):
+        # raises ImportError without h2, before the event loop thread is started
+        limits = httpx.Limits(max_connections=maxConnections,
+                              max_keepalive_connections=maxConnections)
+        self.client = httpx.AsyncClient(http2=True, limits=limits, timeout=None)
+        self.exceptions = (httpx.HTTPError,)
+
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, name="ota-http2")
+        thread.daemon = True
+        thread.start()
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        """Same arguments as requests.request(), blocks until the response is read."""
+        headers = dict(headers or {})
+
+        # requests takes raw bodies (strings, files) as data, httpx as content
+        if isinstance(data, dict):
+            kwargs["data"] = data
+        elif hasattr(data, "read"):
+            headers.setdefault("Content-Length", str(os.fstat(data.fileno()).st_size))
+            kwargs["content"] = _readChunks(data)
+        elif data is not None:
+            kwargs["content"] = data
+
+        future = asyncio.run_coroutine_threadsafe(
+            self.client.request(method, url, headers=headers, **kwargs), self.loop)
+        return future.result()
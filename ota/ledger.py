@@ -0,0 +1,259 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Push ledger of the deploy tool: records which devices already accepted
+# which image, so a retried or extended deploy does not push them again.
+
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+
+from ota.core import getMillisTimestamp
+
+
+# deploy push accepted by the OTA service
+PUSH_ACCEPTED = 202
+
+
+class BloomFilter(object):
+    """
+    Fixed size Bloom filter of "imageId:deviceId" keys, stored in a file next
+    to the push ledger.  A negative answer is definite, so devices that were
+    never pushed an image do not need a ledger lookup.
+
+    generation is the ledger generation the filter has all the accepted pushes
+    of, 0 if unknown.
+    """
+
+    # capacity, number of bits, number of hashes, number of keys, generation
+    HEADER = struct.Struct("!QQQQQ")
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.nbits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.nhashes = max(1, int(round(self.nbits * math.log(2) / capacity)))
+        self.count = 0
+        self.added = 0    # keys added since loaded or saved
+        self.generation = 0
+        self.bits = bytearray((self.nbits + 7) // 8)
+
+    def _positions(self, key):
+        # double hashing: k positions from the two halves of one md5 digest
+        h1, h2 = struct.unpack("!QQ", hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self.nbits for i in range(self.nhashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+        self.added += 1
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def full(self):
+        return self.count > self.capacity
+
+    def save(self, filename):
+        """
+        Saves the filter, adding the keys of the saved one if it has the same
+        size: several deploy processes can share a ledger and its filter.  The
+        union has the accepted pushes of the newer of the two generations.
+        """
+        import fcntl
+
+        with open(filename + ".lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if os.path.exists(filename):
+                saved = BloomFilter.load(filename)
+                if saved is not None and (saved.nbits, saved.nhashes) == (self.nbits, self.nhashes):
+                    for i in range(len(self.bits)):
+                        self.bits[i] |= saved.bits[i]
+                    self.count = max(self.count, saved.count + self.added)
+                    self.generation = max(self.generation, saved.generation)
+            with open(filename + ".tmp", 'wb') as bloom_file:
+                bloom_file.write(self.HEADER.pack(self.capacity, self.nbits, self.nhashes,
+                                                  self.count, self.generation))
+                bloom_file.write(self.bits)
+            os.rename(filename + ".tmp", filename)
+        self.added = 0
+
+    @classmethod
+    def load(cls, filename):
+        """Returns the saved filter, or None if the file is not a valid one."""
+        with open(filename, 'rb') as bloom_file:
+            header = bloom_file.read(cls.HEADER.size)
+            bits = bytearray(bloom_file.read())
+        if len(header) != cls.HEADER.size:
+            return None
+        bloom = cls.__new__(cls)
+        bloom.capacity, bloom.nbits, bloom.nhashes, bloom.count, bloom.generation = cls.HEADER.unpack(header)
+        if len(bits) != (bloom.nbits + 7) // 8:
+            return None
+        bloom.added = 0
+        bloom.bits = bits
+        return bloom
+
+
+class PushLedger(object):
+    """
+    On-disk record of (deviceId, imageId, result, timestamp) for every push.
+
+    The rows are kept in a sqlite table clustered on (imageId, deviceId), so a
+    membership check is a B-tree lookup and the file stays compact with tens of
+    millions of rows.  Only the latest push of an image to a device is kept.
+
+    The ledger generation in the meta table is incremented by every commit
+    that records accepted pushes, with or without the Bloom filter, so a
+    filter that misses some of them is detected and rebuilt.
+    """
+
+    def __init__(self, filename, useBloom=False):
+        self.filename = filename
+        # several deploy processes may write to the same ledger
+        self.db = sqlite3.connect(filename, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS pushes ("
+                        " imageId   INTEGER NOT NULL,"
+                        " deviceId  TEXT    NOT NULL,"
+                        " result    INTEGER NOT NULL,"
+                        " timestamp INTEGER NOT NULL,"
+                        " PRIMARY KEY (imageId, deviceId)) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pushes_timestamp ON pushes (timestamp)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta ("
+                        " name  TEXT    PRIMARY KEY,"
+                        " value INTEGER NOT NULL)")
+        self.db.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('generation', 1)")
+        self.db.commit()
+
+        self.recorded = False     # accepted pushes recorded since the last commit
+        self.commits = 0          # generations this ledger committed
+        self.bloom = None
+        self.bloomDirty = False
+        if useBloom:
+            self._loadBloom()
+
+    def _bloomFile(self):
+        return self.filename + ".bloom"
+
+    def generation(self):
+        """Returns the ledger generation, incremented by commit()."""
+        return self.db.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0]
+
+    def _loadBloom(self):
+        if os.path.exists(self._bloomFile()):
+            self.bloom = BloomFilter.load(self._bloomFile())
+            # accepted pushes recorded without --bloom, or by a deploy that did
+            # not get to save the filter, are missing from an older generation
+            if (self.bloom is not None and not self.bloom.full()
+                    and self.bloom.generation == self.generation()):
+                return
+        self._rebuildBloom()
+
+    def _rebuildBloom(self):
+        # the rows read after the generation include all of its accepted pushes
+        generation = self.generation()
+        accepted = self.db.execute("SELECT COUNT(*) FROM pushes WHERE result = ?",
+                                   (PUSH_ACCEPTED,)).fetchone()[0]
+        self.bloom = BloomFilter(max(1000000, 2 * accepted))
+        for image, device in self.db.execute("SELECT imageId, deviceId FROM pushes WHERE result = ?",
+                                             (PUSH_ACCEPTED,)):
+            self.bloom.add(self._key(image, device))
+        self.bloom.added = 0
+        self.bloom.generation = generation
+        self.bloomDirty = True
+
+    def _key(self, image, device):
+        return "{}:{}".format(image, device).encode("utf-8")
+
+    def accepted(self, image, device):
+        """Returns the timestamp the device accepted the image at, or None."""
+        if self.bloom is not None and self._key(image, device) not in self.bloom:
+            return None
+        row = self.db.execute("SELECT timestamp FROM pushes"
+                              " WHERE imageId = ? AND deviceId = ? AND result = ?",
+                              (image, device, PUSH_ACCEPTED)).fetchone()
+        return row[0] if row else None
+
+    def notAccepted(self, image, devices):
+        """Returns the devices of the list that did not accept the image yet."""
+        candidates = devices
+        if self.bloom is not None:
+            candidates = [d for d in devices if self._key(image, d) in self.bloom]
+        done = set()
+        # stay below the sqlite limit on the number of host parameters
+        for i in range(0, len(candidates), 500):
+            batch = candidates[i:i + 500]
+            query = ("SELECT deviceId FROM pushes WHERE imageId = ? AND result = ?"
+                     " AND deviceId IN ({})".format(",".join("?" * len(batch))))
+            done.update(row[0] for row in self.db.execute(query, [image, PUSH_ACCEPTED] + batch))
+        return [d for d in devices if d not in done]
+
+    def record(self, image, device, result):
+        self.db.execute("INSERT OR REPLACE INTO pushes (imageId, deviceId, result, timestamp)"
+                        " VALUES (?, ?, ?, ?)",
+                        (image, device, result, getMillisTimestamp()))
+        if result == PUSH_ACCEPTED:
+            self.recorded = True
+            if self.bloom is not None:
+                self.bloom.add(self._key(image, device))
+                self.bloomDirty = True
+
+    def expire(self, days):
+        """Drops the entries older than the given number of days, returns how many."""
+        cutoff = getMillisTimestamp() - int(days * 24 * 3600 * 1000)
+        cursor = self.db.execute("DELETE FROM pushes WHERE timestamp < ?", (cutoff,))
+        self.db.commit()
+        # expired keys stay in the Bloom filter; they only cost a ledger lookup
+        return cursor.rowcount
+
+    def commit(self):
+        if self.recorded:
+            # in the transaction of the pushes: no other writer can commit
+            # between the update and the select
+            self.db.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+            generation = self.generation()
+            if self.bloom is not None:
+                # the filter has all the accepted pushes of the new generation
+                # only if no other process committed some since its own
+                if self.bloom.generation == generation - 1:
+                    self.bloom.generation = generation
+                else:
+                    self.bloom.generation = 0
+            self.recorded = False
+            self.commits += 1
+        self.db.commit()
+
+    def stampBloom(self, fromGeneration, commits, geometry):
+        """
+        Marks the saved Bloom filter as having all the accepted pushes of the
+        current generation, once the deploy processes that loaded it at
+        fromGeneration, with (nbits, nhashes) geometry, made the given number
+        of commits and saved their keys to it.  Any other commit in between
+        leaves it to be rebuilt.  Returns whether the filter was marked.
+        """
+        generation = self.generation()
+        if generation != fromGeneration + commits or not os.path.exists(self._bloomFile()):
+            return False
+        bloom = BloomFilter.load(self._bloomFile())
+        # a process that rebuilt a full filter replaced it rather than adding to it
+        if bloom is None or (bloom.nbits, bloom.nhashes) != geometry:
+            return False
+        bloom.generation = generation
+        bloom.save(self._bloomFile())
+        return True
+
+    def close(self):
+        self.commit()
+        if self.bloom is not None and self.bloomDirty:
+            if self.bloom.full():
+                self._rebuildBloom()
+            self.bloom.save(self._bloomFile())
+            self.bloomDirty = False
+        self.db.close()
@@ -0,0 +1,289 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# CPU and memory profiling of the upload and deploy phases: --profile <dir>.
+#
+# The tools run each phase of their pipeline (createOTARecord, uploadOTAImages,
+# associatePoolImages, listOTAImages, deployOTAImage, ...) in a
+# "with profiling.phase(name):" block.  Unless profiling was enabled, phase()
+# returns a shared do-nothing context, so the hooks cost a function call.
+# A phase should be coarse: a whole worker loop, not a single request, as each
+# run takes a lock and enables cProfile.
+#
+# When enabled, for each phase the directory gets:
+# - <phase>.pstats          cProfile stats of the phase (python -m pstats)
+# - <phase>.collapsed       sampled stacks of the threads running the phase,
+#                           one "frame;frame;... count" per line (flamegraph.pl,
+#                           speedscope)
+# - <phase>.allocations.txt top allocations of the phase (tracemalloc, Python 3)
+# - <phase>.snapshot        tracemalloc snapshot at the end of the phase
+#                           (phases run many times are snapshotted after
+#                           1, 2, 4, ... seconds, and at exit)
+# and summary.txt has the calls, time and samples of every phase.
+#
+# On Python 3.12+ only one cProfile profiler can run at a time and it sees
+# every thread: runs of phases overlapping another profiled one (the other
+# --jobs workers, the push ledger phase of a deploy) are only sampled, and the
+# pstats of a phase may include the calls of other threads.  The collapsed
+# stacks are always attributed per thread.
+
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+
+
+SAMPLE_INTERVAL = 0.005      # seconds between two stack samples
+TRACEMALLOC_FRAMES = 1       # frames kept per allocation, more with PYTHONTRACEMALLOC=<n>
+TOP_ALLOCATIONS = 25         # lines of the allocations summaries
+SNAPSHOT_INTERVAL = 1.0      # seconds before the second end snapshot of a phase
+
+
+_profiler = None
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    """Context manager around one run of a pipeline phase."""
+    if _profiler is None:
+        return _NO_PHASE
+    return _Phase(_profiler, name)
+
+
+def enable(directory):
+    """Starts profiling the phases, written to directory at exit or by finish()."""
+    global _profiler
+
+    import atexit
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    _profiler = _Profiler(directory)
+    atexit.register(finish)
+
+
+def finish():
+    """Stops profiling and writes the profiles of the phases."""
+    global _profiler
+
+    profiler = _profiler
+    _profiler = None
+    if profiler is not None:
+        profiler.write()
+
+
+class _PhaseStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.profiledCalls = 0
+        self.seconds = 0.0
+        self.active = 0
+        self.samples = 0
+        self.stacks = {}
+        self.startSnapshot = None
+        self.endSnapshot = None
+        self.endSnapshotTime = 0.0
+        self.snapshotInterval = SNAPSHOT_INTERVAL
+        self.endPending = False
+
+
+class _Profiler(object):
+    def __init__(self, directory):
+        import cProfile
+        import pstats
+
+        self.directory = directory
+        self.cProfile = cProfile
+        self.pstats = pstats
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.active = {}         # thread ident -> name of the phase it runs
+        self.profiles = {}       # (thread ident, phase) -> cProfile.Profile
+
+        try:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.tracemalloc = tracemalloc
+        except ImportError:
+            self.tracemalloc = None
+
+        self.running = True
+        self.sampler = threading.Thread(target=self.sample, name="ota-profiling")
+        self.sampler.daemon = True
+        self.sampler.start()
+
+    def phaseStats(self, name):
+        if name not in self.phases:
+            self.phases[name] = _PhaseStats(name)
+        return self.phases[name]
+
+    def profile(self, ident, name):
+        # one profiler per thread and phase, enabled again on each run
+        key = (ident, name)
+        if key not in self.profiles:
+            self.profiles[key] = self.cProfile.Profile()
+        return self.profiles[key]
+
+    def snapshot(self):
+        return self.tracemalloc.take_snapshot()
+
+    def topAllocations(self, statistics):
+        # filtering the statistics rather than the snapshot traces: far fewer
+        excluded = (self.tracemalloc.__file__, __file__, "<frozen importlib._bootstrap>")
+        top = [stat for stat in statistics if stat.traceback[0].filename not in excluded]
+        return top[:TOP_ALLOCATIONS]
+
+    def sample(self):
+        while self.running:
+            time.sleep(SAMPLE_INTERVAL)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, name in list(self.active.items()):
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        code = frame.f_code
+                        labels.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                        frame = frame.f_back
+                    stack = ";".join(reversed(labels))
+                    stats = self.phases[name]
+                    stats.stacks[stack] = stats.stacks.get(stack, 0) + 1
+                    stats.samples += 1
+
+    def write(self):
+        self.running = False
+        self.sampler.join()
+
+        with self.lock:
+            phases = sorted(self.phases.values(), key=lambda stats: stats.name)
+            for stats in phases:
+                self.writePhase(stats)
+            self.writeSummary(phases)
+        print("Profile written to: {}".format(self.directory))
+
+    def writePhase(self, stats):
+        base = os.path.join(self.directory, stats.name)
+
+        pstats = None
+        for (ident, name), profile in self.profiles.items():
+            if name != stats.name or not profile.getstats():
+                continue
+            if pstats is None:
+                pstats = self.pstats.Stats(profile)
+            else:
+                pstats.add(profile)
+        if pstats is not None:
+            pstats.dump_stats(base + ".pstats")
+
+        if stats.endPending:
+            stats.endSnapshot = self.snapshot()
+
+        with open(base + ".collapsed", 'w') as collapsed_file:
+            for stack, count in sorted(stats.stacks.items()):
+                collapsed_file.write("{} {}\n".format(stack, count))
+
+        if stats.startSnapshot is not None and stats.endSnapshot is not None:
+            stats.endSnapshot.dump(base + ".snapshot")
+            with open(base + ".allocations.txt", 'w') as allocations_file:
+                allocations_file.write("Top {} allocations of {} (size change over the phase)\n\n".format(
+                                       TOP_ALLOCATIONS, stats.name))
+                for stat in self.topAllocations(stats.endSnapshot.compare_to(stats.startSnapshot, "lineno")):
+                    allocations_file.write("{}\n".format(stat))
+
+    def writeSummary(self, phases):
+        with open(os.path.join(self.directory, "summary.txt"), 'w') as summary_file:
+            summary_file.write("{0:<25}  {1:>8}  {2:>10}  {3:>10}  {4:>8}\n".format(
+                               "phase", "calls", "profiled", "seconds", "samples"))
+            for stats in phases:
+                summary_file.write("{0:<25}  {1:>8}  {2:>10}  {3:>10.3f}  {4:>8}\n".format(
+                                   stats.name, stats.calls, stats.profiledCalls, stats.seconds, stats.samples))
+
+            if self.tracemalloc is not None:
+                current, peak = self.tracemalloc.get_traced_memory()
+                summary_file.write("\nTraced memory: {:.1f} KiB, peak {:.1f} KiB\n".format(
+                                   current / 1024.0, peak / 1024.0))
+                summary_file.write("\nTop {} allocations at exit\n\n".format(TOP_ALLOCATIONS))
+                for stat in self.topAllocations(self.snapshot().statistics("lineno")):
+                    summary_file.write("{}\n".format(stat))
+            else:
+                summary_file.write("\nNo allocations: tracemalloc needs Python 3\n")
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.ident = threading.current_thread().ident
+        self.nested = False
+        self.profile = None
+        self.start = None
+
+    def __enter__(self):
+        profiler = self.profiler
+
+        with profiler.lock:
+            # a phase run from another phase is accounted to the outer one
+            if self.ident in profiler.active:
+                self.nested = True
+                return self
+            stats = profiler.phaseStats(self.name)
+            stats.calls += 1
+            stats.active += 1
+            if stats.active == 1 and profiler.tracemalloc is not None and stats.startSnapshot is None:
+                stats.startSnapshot = profiler.snapshot()
+            profiler.active[self.ident] = self.name
+            self.profile = profiler.profile(self.ident, self.name)
+
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Python 3.12+: another phase holds the profiler
+            self.profile = None
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.nested:
+            return False
+
+        elapsed = time.time() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+
+        profiler = self.profiler
+        with profiler.lock:
+            del profiler.active[self.ident]
+            stats = profiler.phaseStats(self.name)
+            stats.seconds += elapsed
+            stats.active -= 1
+            if self.profile is not None:
+                stats.profiledCalls += 1
+            if stats.active == 0 and profiler.tracemalloc is not None:
+                now = time.time()
+                # snapshots are slow, doubling the interval keeps their
+                # number small in phases run many times
+                if now - stats.endSnapshotTime >= stats.snapshotInterval:
+                    if stats.endSnapshot is not None:
+                        stats.snapshotInterval *= 2
+                    stats.endSnapshot = profiler.snapshot()
+                    stats.endSnapshotTime = now
+                    stats.endPending = False
+                else:
+                    stats.endPending = True
+        return False
@@ -0,0 +1,50 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Sharding of device ids for deploys spread over processes and hosts.
+#
+# A device is assigned to a shard by jump consistent hashing of its id, so
+# every worker can pick its own devices out of the same device list without
+# any coordination, and changing the number of shards moves as few devices
+# as possible from one shard to another.
+
+import hashlib
+import os
+import struct
+
+
+def jumpHash(key, buckets):
+    """
+    Jump consistent hash (Lamping & Veach): maps the 64-bit key to a bucket
+    in [0, buckets).
+    """
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def deviceShard(device, count, salt=""):
+    """
+    Returns the shard in [0, count) of the device.  Different salts give
+    independent assignments, used to split a shard again between processes.
+    """
+    digest = hashlib.md5((salt + device).encode("utf-8")).digest()
+    return jumpHash(struct.unpack("!Q", digest[:8])[0], count)
+
+
+def parseShard(value):
+    """Parses a "<index>/<count>" shard option, raising ValueError if invalid."""
+    index, count = value.split("/")
+    index, count = int(index), int(count)
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("invalid shard {}".format(value))
+    return index, count
+
+
+def shardFileName(filename, index, count):
+    """results.jsonl -> results.<index>-of-<count>.jsonl"""
+    base, ext = os.path.splitext(filename)
+    return "{}.{}-of-{}{}".format(base, index, count, ext)
@@ -0,0 +1,679 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Creating an OTA image record on the service and returning the OTA record ID,
+# and uploading the OTA image(s) of the record.
+#
+# Firmware type defined in the OTA Service supported by this tool:
+# - Hub (Attribute ID 2005, Type 5)
+# - service: on prod
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import getopt
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ota import core
+from ota import profiling
+from ota.core import OTA_SERVICE_HOST_URL, OTA_IMAGE_TYPE
+
+
+commonConfig = []
+buildType_debug = False
+buildNumber = ""
+createOTARecordFlag = False
+uploadFromOTARecordFlag = False
+access_token = None
+
+# By default, we want to store the OTA record output file to bitbake's $TMPDIR
+# this will integrate into the bitbake build environment, and Afero's
+# bitbake recipe looks for the OTA record file and if found, put it in the
+# rootfs system of the image.
+#
+# For testing, you can use -s option to skip the search for bitbake $TMPDIR
+# and the OTA record is stored in the current running directory.
+skip_search_tmpdir = True
+
+
+#
+# Default configuration file: can be changed using --conf <file>
+#
+configFile = core.DEFAULT_CONFIG_FILE
+
+
+# OTA record output file
+otaRecordFileName = "full_ota_record.json"
+
+
+#
+# Batch (backfill) mode: publish every release listed in the manifest given
+# with --batch <file>, using --jobs worker threads.  The records of all the
+# releases are written to a single consolidated output file.
+#
+batchFile = None
+batchJobs = 4
+otaBatchRecordFileName = "full_ota_batch_record.json"
+
+# --http2: HTTP/2 transport to the OTA service, see ota/core.py
+http2Flag = False
+
+# --profile <dir>: profiles of the phases, see ota/profiling.py
+profileDir = None
+
+# "ota batch [options] <manifest>": the manifest is a positional argument
+batchManifestArg = False
+
+# program name in the usage, "ota <command>" when run by ota/cli.py
+progName = os.path.basename(sys.argv[0])
+
+
+# load the configuration json file
+def loadCommonConfig():
+    global commonConfig
+
+    commonConfig = releaseConfig(core.loadCommonConfig(configFile), buildNumber, buildType_debug)
+
+
+def releaseConfig(baseConfig, buildNum, debug, imageFiles=None):
+    """
+    Return a copy of the configuration for one release.
+
+    The version from the config file is replaced to include the build number
+    and debug(d), e.g. 1.0.123 or 1.0.123d.
+    """
+    config = dict(baseConfig)
+
+    version = str(baseConfig["version"])
+    extension = ""
+    if (debug == True):
+        extension = "d"
+    config["version"] = version + "." + str(buildNum) + extension
+
+    if imageFiles:
+        config["imageFiles"] = imageFiles
+
+    ts = core.getMillisTimestamp()
+    config["createdTimestamp"] = ts
+    config["updatedTimestamp"] = ts
+
+    return config
+
+
+def createOTARecord(commonConfig):
+    """
+    Create a firmware pool image record.
+
+    Note: Use an empty string for the url field on the request
+    payload. We will update this field once we have uploaded the firmware binary file.
+
+    POST /v1/ota/partners/{partnerId}/pool
+    """
+    url_frag = "/v1/ota/partners/{}/pool"
+    request_url = "%s%s" % (OTA_SERVICE_HOST_URL, url_frag)
+
+    headers = { "Content-Type" : "application/json",
+                "Accept"       : "application/json",
+                "Authorization": "Bearer {}".format(access_token)}
+    payload = {
+                   "name"       : str(commonConfig["name"]),
+                   "description": str(commonConfig["description"]),
+                   "type"       : int(OTA_IMAGE_TYPE),
+                   "version"    : str(commonConfig["version"]),
+                   "url"        : ""
+              }
+    resp = core.request("POST", request_url.format(commonConfig["partnerId"]),
+                        data=json.dumps(payload),
+                        headers=headers,
+                        timeout=None)
+    if resp.status_code == 201:
+        print("OTA record is created")
+    else:
+        print("Err: respond code {}".format(resp.status_code))
+        print("    \t")
+        jresp = resp.json()
+        ret_text = jresp["trace"]
+        print(ret_text.split("at", 1)[0])
+        exit (-2)
+
+    return json.loads(resp.text)
+
+
+
+# Updates a firmware image in the pool.
+#
+# OTA API:
+# PUT /v1/ota/partners/{partnerId}/pool/types/{type}/versionNumbers/{versionNumber}
+#
+def updateOTAImage(commonConfig, responseBody):
+    url = "{}/v1/ota/partners/{}/pool/types/{}/versionNumbers/{}".format(
+                   OTA_SERVICE_HOST_URL,
+                   commonConfig["partnerId"],
+                   OTA_IMAGE_TYPE,
+                   responseBody["versionNumber"]
+                   )
+    headers = { "Content-Type" : "application/json",
+                "Authorization": "Bearer {}".format(access_token)}
+    payload = responseBody
+
+    response = core.request("PUT", url,
+                            headers=headers,
+                            json=payload,
+                            timeout=None)
+    if response.status_code != 204:
+        print("Bad response ({}) from {}".format(response.status_code, url))
+        print(response.text)
+        exit(-7)
+
+
+# 1. Uploads a firmware file to a temporary location
+# 2. Moves a file from the temporary location to the permanent firmware image repo.
+def uploadOTAImage(commonConfig, responseBody, slot):
+    # Upload the file to temporary spot and get the sha256 back.
+    # Note we upload the unsigned file to the OTA server as it gets signed on the way out!
+    filename = str(commonConfig["imageFiles"][slot])
+
+    url = "{}/v1/ota/partners/{}/binaries".format(OTA_SERVICE_HOST_URL,
+                                                  commonConfig["partnerId"])
+    headers = { "Content-Type" : "application/octet-stream",
+                "Accept"       : "application/json",
+                "Authorization": "Bearer {}".format(access_token)}
+    with open(filename, 'rb') as image_file:
+        response = core.request("POST", url,
+                                headers=headers,
+                                data = image_file,
+                                timeout=None)
+
+    if response.status_code != 200:
+        print("Bad response ({}) from {} for {}".format(response.status_code, url, filename))
+        print(response.text)
+        exit(-4)
+    responseJson = json.loads(response.text)
+    sha = responseJson['value']
+
+
+    # Step 2: Move the file to the real spot and get the URL back.
+    url = "{}/v1/ota/partners/{}/binaries/moveToRepository".format(
+               OTA_SERVICE_HOST_URL,
+               commonConfig["partnerId"])
+    headers_2 = { "Content-Type" : "application/json",
+                  "Accept"       : "application/json",
+                  "Authorization": "Bearer {}".format(access_token)}
+    payload = { "value": str(sha) }
+
+    response = core.request("POST", url,
+                            headers=headers_2,
+                            data=json.dumps(payload),
+                            timeout=None)
+    if response.status_code != 200:
+        print("Bad response ({}) from {}".format(response.status_code, url))
+        print(response.text)
+        exit(-5)
+
+
+    responseJson = json.loads(response.text)
+
+    # Update the OTA record with the new URL.
+    # slot 'a' is a convenient way to specify the image.
+    if (slot == "a"):
+        responseBody["url"] = responseJson['value']
+    else:
+        responseBody["url2"] = responseJson['value']
+
+    if ("id" in responseBody):
+      print("Update OTA Record with the storage URL")
+      updateOTAImage(commonConfig, responseBody)
+    else:
+      print("Error, No OTA Record ID Found")
+      exit(-6)
+
+
+# Uploading the OTA image(s)
+def uploadOTAImages(commonConfig, responseBody):
+    files = commonConfig["imageFiles"]
+    for key, file in files.items():
+        uploadOTAImage(commonConfig, responseBody, key)
+
+
+def associatePoolImages(commonConfig, responseBody):
+    """
+    Creates a new firmware image association with a device type.
+    POST /v1/ota/partners/{partnerId}/deviceTypes/{deviceTypeId}/firmwareImages
+    """
+    url = "{}/v1/ota/partners/{}/deviceTypes/{}/firmwareImages".format(
+            OTA_SERVICE_HOST_URL,
+            commonConfig["partnerId"],
+            commonConfig["deviceTypeId"]
+            )
+    headers = {
+               "Content_Type" : "application/json",
+               "Accept"       : "application/json",
+               "Authorization": "Bearer {}".format(access_token)
+              }
+
+    if ("id" in responseBody):
+        body = responseBody
+    else:
+       print("Error, No OTA Record ID Found")
+       exit (-7)
+
+    response = core.request("POST", url, headers=headers, json=body, timeout=None)
+    if response.status_code != 201:
+        if (response.status_code == 409):
+            print("A firmware image with this type and version already exists:{}, {}".format(
+                     OTA_IMAGE_TYPE,
+                     commonConfig["version"]))
+        else:
+            print("Bad response ({}) from {}".format(response.status_code, url))
+            ret_val = response.json()
+            core.print_err_response(ret_val)
+
+        exit(-8)
+
+    return json.loads(response.text)
+
+
+def IsImageUploaded(commonConfig, VersionNumber):
+    """
+    GET /v1/ota/partners/{}/deviceTypes/{}/firmwareImages/types/{}/versionNumbers/{}
+    - Retrieves a firmware image by type and version number
+    """
+    url = "{}/v1/ota/partners/{}/deviceTypes/{}/firmwareImages/types/{}/versionNumbers/{}".format(
+                 OTA_SERVICE_HOST_URL,
+                 commonConfig["partnerId"],
+                 commonConfig["deviceTypeId"],
+                 OTA_IMAGE_TYPE,
+                 VersionNumber)
+    headers = {
+               "Accept"       : "application/json",
+               "Authorization": "Bearer {}".format(access_token)
+              }
+    response = core.request("GET", url, headers=headers)
+    if (response.status_code == 200):
+        return True
+    elif (response.status_code == 404):
+        return False
+    else:
+        if (response.status_code == 401):
+            print("Unauthorized request")
+        else:
+            print("Bad response ({}) from {}".format(response.status_code, url))
+            core.print_err_response(response.json())
+
+        exit (-14)
+
+
+def loadBatchManifest(baseConfig):
+    """
+    Load the batch manifest and return the release configurations it lists.
+
+    The manifest is a json file of the form:
+      { "releases": [ { "buildNum": "123", "debug": false, "imageFiles": { "a": "hub_update.bin" } },
+                      ... ] }
+    "debug" defaults to false (release), and "imageFiles" defaults to the
+    image files of the configuration file.
+    """
+    with open(batchFile) as data_file:
+        data = json.load(data_file)
+
+    releases = []
+    versions = set()
+    for entry in data["releases"]:
+        if not entry.get("buildNum"):
+            print("No build number specified for manifest entry: {}".format(entry))
+            exit (-15)
+
+        config = releaseConfig(baseConfig,
+                               entry["buildNum"],
+                               entry.get("debug", False),
+                               entry.get("imageFiles"))
+        if config["version"] in versions:
+            print("ERROR: version {} is listed more than once in {}".format(config["version"], batchFile))
+            exit (-15)
+        versions.add(config["version"])
+        releases.append(config)
+
+    return releases
+
+
+def publishRelease(config, result, previousRecord=None):
+    """
+    Create the OTA record, upload the image(s) and associate them with the
+    device type for one release.
+
+    previousRecord is the OTA record of the release from an earlier batch run:
+    if that run failed after creating the record, the upload and association
+    are resumed.  The OTA record is stored in result["record"] as soon as it is
+    known, so that a failing release keeps it for the next run.
+
+    Returns "published", or "exists" if the release is already on the service.
+    """
+    if core.otaRecordForDeviceTypeExists(config, access_token) == True:
+        if previousRecord is None:
+            print("Release {} already exists, skipping".format(config["version"]))
+            return "exists"
+        otaRecord = previousRecord
+        result["record"] = otaRecord
+        if IsImageUploaded(config, int(otaRecord["versionNumber"])) == True:
+            print("Release {} already uploaded, skipping".format(config["version"]))
+            return "exists"
+        print("Release {} record exists, resuming its upload".format(config["version"]))
+    else:
+        with profiling.phase("createOTARecord"):
+            otaRecord = createOTARecord(config)
+        result["record"] = otaRecord
+
+    with profiling.phase("uploadOTAImages"):
+        uploadOTAImages(config, otaRecord)
+    with profiling.phase("associatePoolImages"):
+        associatePoolImages(config, otaRecord)
+    print("Release {} done".format(config["version"]))
+
+    return "published"
+
+
+def publishReleases(releases, previousResults=None):
+    """
+    Publish the releases using batchJobs worker threads, so the record creation,
+    upload and association of different releases overlap.
+
+    previousResults are the results of an earlier run, as returned by this
+    function: the releases it failed to upload are resumed from their record.
+
+    Returns a dict of version -> result.  A failing release does not stop the
+    others; its result records the exit code or error, and the OTA record if
+    it was created.
+    """
+    previousResults = previousResults or {}
+    work = queue.Queue()
+    for config in releases:
+        work.put(config)
+
+    results = {}
+    results_lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                config = work.get_nowait()
+            except queue.Empty:
+                return
+
+            previousRecord = previousResults.get(config["version"], {}).get("record")
+            result = {}
+            try:
+                result["status"] = publishRelease(config, result, previousRecord)
+            except SystemExit as e:
+                result.update({ "status": "failed", "exitCode": e.code })
+            except Exception as e:
+                # e.g. a non json error body from the service
+                result.update({ "status": "failed", "error": "{}: {}".format(type(e).__name__, e) })
+
+            with results_lock:
+                results[config["version"]] = result
+
+    workers = [threading.Thread(target=worker) for i in range(min(batchJobs, len(releases)))]
+    for t in workers:
+        t.daemon = True
+        t.start()
+    for t in workers:
+        t.join()
+
+    return results
+
+
+def usage():
+    if batchManifestArg:
+        print(progName + " [-h] [-c <config_file>] [-s] [-j <jobs>] <manifest>")
+    else:
+        print(progName + " [-h] [-c <config_file>] [-d] [-s] -n <build number>")
+        print(progName + " [-h] [-c <config_file>] [-s] [-j <jobs>] --batch <manifest>")
+    print("\t-h               : help")
+    print("\t-s               : skip search for bitbake TMPDIR (** NOT for production build)")
+    print("\t-n  --buildNum   : build number")
+    print("\t-d  --debug      : build type debug (defaults to release)")
+    print("\t-c  --conf       : path and name of the configuration file")
+    print("\t    --createOTARecord  : create an OTA Record  OR  ")
+    print("\t    --uploadOTAImage   : upload OTA Record & image")
+    print("\t    --batch    : create, upload & associate every release in the manifest file")
+    print("\t-j  --jobs     : number of releases processed concurrently in batch mode (default {})".format(batchJobs))
+    print("\t    --http2    : use HTTP/2 to the OTA service (needs httpx[http2])")
+    print("\t    --profile  : write CPU and memory profiles of the phases to <dir>")
+    exit (-10)
+
+
+def parseArgs(argv):
+    global buildNumber
+    global buildType_debug
+    global configFile
+    global createOTARecordFlag
+    global uploadFromOTARecordFlag
+    global skip_search_tmpdir
+    global batchFile
+    global batchJobs
+    global http2Flag
+    global profileDir
+    opts = ""
+
+    try:
+        # gnu_getopt: options may follow the manifest of "ota batch"
+        opts, args = getopt.gnu_getopt(argv, "hdsc:n:j:", ["buildNum=", "debug", "conf=", "createOTARecord","uploadOTAImage",
+                                                  "batch=", "jobs=", "http2", "profile="])
+    except getopt.GetoptError:
+        usage()
+
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+        elif opt in ("-n", "--buildNum"):
+            try:
+                buildNumber = arg
+            except ValueError:
+                usage()
+        elif opt in ("-s"):
+            skip_search_tmpdir = False
+        elif opt in ("-d", "--debug"):
+            buildType_debug = True
+        elif opt in ("-c", "--conf"):
+            configFile = arg
+        elif opt in ("--createOTARecord"):
+            createOTARecordFlag = True
+        elif opt in ("--uploadOTAImage"):
+            uploadFromOTARecordFlag = True
+        elif opt == "--batch":
+            batchFile = arg
+        elif opt == "--http2":
+            http2Flag = True
+        elif opt == "--profile":
+            profileDir = arg
+        elif opt in ("-j", "--jobs"):
+            try:
+                batchJobs = int(arg)
+            except ValueError:
+                usage()
+            if batchJobs < 1:
+                usage()
+
+    return args
+
+
+def read_bitbake_tmpdir():
+    import subprocess
+
+    result_str = subprocess.check_output('bitbake -e | grep ^TMPDIR', shell=True)
+    result_str = result_str.decode("utf-8")
+    if "TMPDIR=" in result_str:
+        dir_list = result_str.split("=")
+        tmpdir = dir_list[1]
+
+        # remove the newline character at end, and the quotes
+        tmpdir = tmpdir.replace('\n', '')
+        tmpdir = tmpdir[1:-1]
+        return ( tmpdir )
+    else:
+        print("Error: Invalid dir {}".format(result_str))
+        exit (-11)
+
+
+def batchMain():
+    global commonConfig
+    global access_token
+
+    baseConfig = core.loadCommonConfig(configFile)
+    if not baseConfig["deviceTypeId"]:
+        print("No device type id found in partner-ota-conf.json")
+        exit (-13)
+
+    releases = loadBatchManifest(baseConfig)
+
+    commonConfig = baseConfig
+    access_token = core.getAccessToken(commonConfig)
+
+    tmpdir=""
+    if skip_search_tmpdir == True:
+       tmpdir=read_bitbake_tmpdir()
+    output_ota_rec_filename = os.path.join(tmpdir, otaBatchRecordFileName)
+
+    # the records of an earlier run, to resume the releases it failed to upload
+    previousResults = {}
+    if os.path.exists(output_ota_rec_filename):
+        with open(output_ota_rec_filename) as ota_file:
+            previousResults = json.load(ota_file)
+
+    print("Publishing {} releases with {} jobs ....".format(len(releases), batchJobs))
+    results = publishReleases(releases, previousResults)
+    for config in releases:
+        if config["version"] not in results:
+            results[config["version"]] = { "status": "failed", "error": "no result" }
+
+    # keep the records of the releases of earlier runs too
+    records = dict(previousResults)
+    records.update(results)
+    print("OTA Records output to: {}".format(output_ota_rec_filename))
+    with open(output_ota_rec_filename, 'w') as ota_file:
+       ota_file.write(json.dumps(records, sort_keys=True, indent=4, separators=(',', ': ')))
+
+    failed = [version for version, result in results.items() if result["status"] == "failed"]
+    print("Published: {}, already existing: {}, failed: {}".format(
+          len([r for r in results.values() if r["status"] == "published"]),
+          len([r for r in results.values() if r["status"] == "exists"]),
+          len(failed)))
+    if failed:
+        print("Failed releases: {}".format(", ".join(sorted(failed))))
+        exit (-16)
+
+
+def batchCommand(argv, prog=None):
+    """Entry point of "ota batch", which takes the manifest as positional argument."""
+    global batchManifestArg
+
+    batchManifestArg = True
+    main(argv, prog)
+
+
+def main(argv, prog=None):
+    global commonConfig
+    global access_token
+    global batchFile
+    global progName
+
+    if prog:
+        progName = prog
+
+    args = parseArgs(argv)
+
+    if batchManifestArg:
+        if not args:
+            print("No batch manifest specified")
+            usage()
+        batchFile = args[0]
+
+    if profileDir:
+        profiling.enable(profileDir)
+
+    core.configureTransport(http2Flag, batchJobs)
+
+    if batchFile:
+        batchMain()
+        return
+
+    if not buildNumber:
+        print("No build number specified")
+        usage()
+
+    loadCommonConfig()
+
+    access_token = core.getAccessToken(commonConfig)
+
+
+    if commonConfig["deviceTypeId"]:
+        rec_exist = core.otaRecordForDeviceTypeExists(commonConfig, access_token)
+        if (uploadFromOTARecordFlag == True and rec_exist == False):
+            print("ERROR: No OTA Record for HUB image: {}, version={}. Create OTA Record first".format(
+                  commonConfig["name"],
+                  commonConfig["version"]))
+            exit (-11)
+        if (createOTARecordFlag == True and rec_exist == True):
+            print("ERROR: A firmware image with type {} with version {} " \
+                      "already exists".format(OTA_IMAGE_TYPE,
+                                              commonConfig["version"]))
+            exit(-12)
+    else:
+        print("No device type id found in partner-ota-conf.json")
+        exit (-13)
+
+
+    # read from the bitbake environment setting to get TMPDIR
+    tmpdir=""
+    if skip_search_tmpdir == True:
+       tmpdir=read_bitbake_tmpdir()
+    output_ota_rec_filename = os.path.join(tmpdir, otaRecordFileName)
+
+    if createOTARecordFlag == True:
+        print("Start to create record .....")
+        with profiling.phase("createOTARecord"):
+            otaRecord = createOTARecord(commonConfig)
+
+        print("OTA Record output to: {}".format(output_ota_rec_filename))
+        with open(output_ota_rec_filename, 'w') as ota_file:
+           ota_file.write(json.dumps(otaRecord,sort_keys=True, indent=4, separators=(',', ': ')))
+           ota_file.close()
+    else:
+        # upload the image:
+        # - read the ota record file
+        if uploadFromOTARecordFlag == True:
+            with open(output_ota_rec_filename) as ota_file:
+                otaRecord = json.load(ota_file)
+
+                if (commonConfig["version"] != otaRecord["version"]):
+                    print("The command request ver({}) is different from OTA Record ver({}). Check your command".format(
+                           commonConfig["version"],
+                           otaRecord["version"] ))
+                    exit (0)
+
+                image_found = IsImageUploaded(commonConfig, int(otaRecord["versionNumber"]))
+                if (image_found == True):
+                    print("A image with type, version already uploaded:{}, {}. Exit".format(
+                                              OTA_IMAGE_TYPE,
+                                              commonConfig["version"]))
+                    exit(0)
+
+                print("Upload the OTA Image .....")
+                with profiling.phase("uploadOTAImages"):
+                    uploadOTAImages(commonConfig, otaRecord)
+
+                print("Associate the Image with the deviceTypeId and ParnerId .....")
+                with profiling.phase("associatePoolImages"):
+                    associatePoolImages(commonConfig, otaRecord)
+                print("Done!")
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
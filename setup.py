@@ -0,0 +1,22 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+
+from setuptools import setup
+
+from ota import __version__
+
+
+setup(
+    name="partner-hub-ota-tools",
+    version=__version__,
+    description="Afero partner hub OTA image upload and deploy tools",
+    license="MIT",
+    packages=["ota"],
+    install_requires=["requests>=2.22,<3.0"],
+    entry_points={
+        "console_scripts": [
+            "ota = ota.cli:main",
+        ],
+    },
+)
@@ -0,0 +1,104 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Tests of the device list deploy:
+#   python -m unittest discover tests
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ota import deploy
+from ota.ledger import PUSH_ACCEPTED, PushLedger
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class DeployOTAImagesTest(unittest.TestCase):
+    SETTINGS = ("devicesFile", "imageId", "deployJobs", "forcePush",
+                "shardCount", "deployProcesses", "pushOTAImage")
+
+    def setUp(self):
+        self.saved = dict((name, getattr(deploy, name)) for name in self.SETTINGS)
+        self.directory = tempfile.mkdtemp()
+
+        self.devices = ["device-{}".format(i) for i in range(50)]
+        deploy.devicesFile = os.path.join(self.directory, "devices.txt")
+        with open(deploy.devicesFile, 'w') as devices_file:
+            devices_file.write("\n".join(self.devices) + "\n")
+        deploy.imageId = 1
+        deploy.deployJobs = 4
+        deploy.forcePush = False
+        deploy.shardCount = 1
+        deploy.deployProcesses = 1
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(deploy, name, value)
+        shutil.rmtree(self.directory)
+
+    def deploy(self):
+        """Runs deployOTAImages, failing the test if it does not return."""
+        results_name = os.path.join(self.directory, "results.jsonl")
+        outcome = {}
+
+        def run():
+            # sqlite connections stay in the thread that opened them
+            ledger = PushLedger(os.path.join(self.directory, "ledger.db"))
+            try:
+                with open(results_name, 'w') as results_file:
+                    outcome["counts"] = deploy.deployOTAImages(ledger, results_file)
+            finally:
+                ledger.close()
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive(), "deployOTAImages did not return")
+
+        with open(results_name) as results_file:
+            results = [json.loads(line) for line in results_file]
+        return outcome["counts"], results
+
+    def test_failing_push(self):
+        def pushOTAImage(device):
+            if device.endswith("7"):
+                raise ValueError("not a json response")
+            return FakeResponse(PUSH_ACCEPTED)
+        deploy.pushOTAImage = pushOTAImage
+
+        counts, results = self.deploy()
+
+        failed = sorted(d for d in self.devices if d.endswith("7"))
+        self.assertEqual(counts, { "accepted": 45, "failed": 5, "skipped": 0 })
+        self.assertEqual(sorted(r["deviceId"] for r in results if r["result"] == "failed"), failed)
+        self.assertEqual(set(r["status"] for r in results if r["result"] == "failed"), set([0]))
+
+    def test_every_push_failing(self):
+        def pushOTAImage(device):
+            raise ValueError("not a json response")
+        deploy.pushOTAImage = pushOTAImage
+
+        counts, results = self.deploy()
+
+        self.assertEqual(counts, { "accepted": 0, "failed": 50, "skipped": 0 })
+        self.assertEqual(len(results), 50)
+
+    def test_accepted_devices_skipped(self):
+        deploy.pushOTAImage = lambda device: FakeResponse(PUSH_ACCEPTED)
+        self.deploy()
+
+        counts, results = self.deploy()
+
+        self.assertEqual(counts, { "accepted": 0, "failed": 0, "skipped": 50 })
+
+
+if __name__ == "__main__":
+    unittest.main()
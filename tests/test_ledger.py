@@ -0,0 +1,125 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Tests of the deploy push ledger and its Bloom filter:
+#   python -m unittest discover tests
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ota.ledger import PUSH_ACCEPTED, PushLedger
+
+
+class PushLedgerBloomTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "ledger.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, devices, useBloom):
+        ledger = PushLedger(self.filename, useBloom)
+        for device in devices:
+            ledger.record(1, device, PUSH_ACCEPTED)
+        ledger.close()
+
+    def test_pushes_recorded_without_bloom(self):
+        old = ["old-{}".format(i) for i in range(100)]
+        new = ["new-{}".format(i) for i in range(100)]
+
+        self.record(old, True)
+        # --force re-pushes add the same keys to the filter again
+        self.record(old, True)
+        self.record(new, False)
+
+        ledger = PushLedger(self.filename, True)
+        try:
+            self.assertEqual(ledger.notAccepted(1, new + ["other"]), ["other"])
+            self.assertIsNotNone(ledger.accepted(1, "new-0"))
+        finally:
+            ledger.close()
+
+    def test_bloom_reused_when_up_to_date(self):
+        devices = ["device-{}".format(i) for i in range(10)]
+        self.record(devices, True)
+        mtime = os.path.getmtime(self.filename + ".bloom")
+
+        ledger = PushLedger(self.filename, True)
+        try:
+            self.assertFalse(ledger.bloomDirty)
+            self.assertEqual(ledger.notAccepted(1, devices + ["other"]), ["other"])
+        finally:
+            ledger.close()
+        self.assertEqual(os.path.getmtime(self.filename + ".bloom"), mtime)
+
+    def test_concurrent_writers(self):
+        # another deploy commits between two commits of a --bloom one
+        first = PushLedger(self.filename, True)
+        second = PushLedger(self.filename, False)
+        first.record(1, "first-0", PUSH_ACCEPTED)
+        first.commit()
+        second.record(1, "second", PUSH_ACCEPTED)
+        second.commit()
+        first.record(1, "first-1", PUSH_ACCEPTED)
+        first.close()
+        second.close()
+
+        ledger = PushLedger(self.filename, True)
+        try:
+            self.assertEqual(ledger.notAccepted(1, ["first-0", "first-1", "second", "other"]), ["other"])
+        finally:
+            ledger.close()
+
+    def sharedDeploy(self, outsideCommit=False):
+        """Runs two deploy processes sharing the filter, as -P 2 --bloom does."""
+        self.record(["old"], True)
+        ledger = PushLedger(self.filename, True)
+        generation = ledger.generation()
+        geometry = (ledger.bloom.nbits, ledger.bloom.nhashes)
+        ledger.close()
+
+        first = PushLedger(self.filename, True)
+        second = PushLedger(self.filename, True)
+        for i in range(3):
+            first.record(1, "first-{}".format(i), PUSH_ACCEPTED)
+            first.commit()
+            second.record(1, "second-{}".format(i), PUSH_ACCEPTED)
+            second.commit()
+        if outsideCommit:
+            self.record(["outside"], False)
+        first.close()
+        second.close()
+
+        ledger = PushLedger(self.filename)
+        try:
+            return ledger.stampBloom(generation, first.commits + second.commits, geometry)
+        finally:
+            ledger.close()
+
+    def test_shared_filter_stamped(self):
+        self.assertTrue(self.sharedDeploy())
+
+        ledger = PushLedger(self.filename, True)
+        try:
+            # up to date: loaded, not rebuilt
+            self.assertFalse(ledger.bloomDirty)
+            self.assertEqual(ledger.notAccepted(1, ["old", "first-2", "second-0", "other"]), ["other"])
+        finally:
+            ledger.close()
+
+    def test_shared_filter_not_stamped_after_other_writer(self):
+        self.assertFalse(self.sharedDeploy(outsideCommit=True))
+
+        ledger = PushLedger(self.filename, True)
+        try:
+            self.assertTrue(ledger.bloomDirty)
+            self.assertEqual(ledger.notAccepted(1, ["outside", "first-0", "other"]), ["other"])
+        finally:
+            ledger.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
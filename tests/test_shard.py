@@ -0,0 +1,125 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Tests of the sharding of deploys over hosts and processes:
+#   python -m unittest discover tests
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ota import deploy
+from ota.shard import deviceShard, parseShard, shardFileName
+
+
+DEVICES = ["device-{}".format(i) for i in range(4000)]
+
+
+class ShardTest(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parseShard("0/3"), (0, 3))
+        self.assertEqual(parseShard("2/3"), (2, 3))
+        for value in ("3/3", "-1/2", "a/b", "0/0", "1", ""):
+            self.assertRaises(ValueError, parseShard, value)
+
+    def test_shard_file_name(self):
+        self.assertEqual(shardFileName("results.jsonl", 1, 3), "results.1-of-3.jsonl")
+        self.assertEqual(shardFileName("out/results", 0, 2), "out/results.0-of-2")
+
+    def test_salted_split_independent(self):
+        # without the salt, the processes of host shard 0 of 2 would split it
+        # exactly as the hosts do, and process 1 would get no device
+        cells = {}
+        for device in DEVICES:
+            cell = (deviceShard(device, 2), deviceShard(device, 2, "process:"))
+            cells[cell] = cells.get(cell, 0) + 1
+        self.assertEqual(sorted(cells), [(0, 0), (0, 1), (1, 0), (1, 1)])
+        for count in cells.values():
+            self.assertTrue(800 < count < 1200, cells)
+
+    def test_growing_moves_few_devices(self):
+        moved = len([d for d in DEVICES if deviceShard(d, 4) != deviceShard(d, 5)])
+        self.assertTrue(moved < len(DEVICES) * 0.3, moved)
+
+
+class ReadDeviceIdsTest(unittest.TestCase):
+    SETTINGS = ("shardIndex", "shardCount", "deployProcesses", "processIndex")
+
+    def setUp(self):
+        self.saved = dict((name, getattr(deploy, name)) for name in self.SETTINGS)
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "devices.txt")
+        with open(self.filename, 'w') as devices_file:
+            devices_file.write("# devices\n")
+            for device in DEVICES:
+                devices_file.write(device + "\n")
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(deploy, name, value)
+        shutil.rmtree(self.directory)
+
+    def read(self, shardIndex, shardCount, processIndex=0, deployProcesses=1):
+        deploy.shardIndex, deploy.shardCount = shardIndex, shardCount
+        deploy.processIndex, deploy.deployProcesses = processIndex, deployProcesses
+        devices = []
+        for chunk in deploy.readDeviceIds(self.filename):
+            devices.extend(chunk)
+        return devices
+
+    def assertPartition(self, parts):
+        seen = []
+        for part in parts:
+            self.assertTrue(part)
+            seen.extend(part)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(sorted(seen), sorted(DEVICES))
+
+    def test_unsharded(self):
+        self.assertEqual(self.read(0, 1), DEVICES)
+
+    def test_host_shards(self):
+        for count in (2, 3, 7):
+            self.assertPartition([self.read(i, count) for i in range(count)])
+
+    def test_host_and_process_shards(self):
+        self.assertPartition([self.read(i, 3, p, 2) for i in range(3) for p in range(2)])
+
+
+class MergeResultsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, results):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as results_file:
+            for device, result in results:
+                results_file.write(json.dumps({ "deviceId": device, "imageId": 1, "result": result }) + "\n")
+        return filename
+
+    def test_merge_results(self):
+        shards = [self.write("r.0-of-2.jsonl", [("a", "accepted"), ("b", "failed"), ("c", "skipped")]),
+                  self.write("r.1-of-2.jsonl", [("d", "accepted"), ("e", "accepted")])]
+        merged = os.path.join(self.directory, "r.jsonl")
+
+        counts = deploy.mergeResults(merged, shards)
+
+        self.assertEqual(counts, { "accepted": 3, "failed": 1, "skipped": 1 })
+        with open(merged) as merged_file:
+            self.assertEqual([json.loads(line)["deviceId"] for line in merged_file], ["a", "b", "c", "d", "e"])
+
+    def test_merge_empty_shard(self):
+        shards = [self.write("r.0-of-2.jsonl", []), self.write("r.1-of-2.jsonl", [("a", "failed")])]
+
+        counts = deploy.mergeResults(os.path.join(self.directory, "r.jsonl"), shards)
+
+        self.assertEqual(counts, { "accepted": 0, "failed": 1, "skipped": 0 })
+
+
+if __name__ == "__main__":
+    unittest.main()
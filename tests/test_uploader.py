@@ -0,0 +1,164 @@
+#
+# Copyright (c) 2017 Afero, Inc. All Rights Reserved.
+#
+# Tests of the batch (backfill) mode of the uploader:
+#   python -m unittest discover tests
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ota import core
+from ota import uploader
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeOTAService(object):
+    """The OTA service endpoints used by the batch mode, replacing core.request."""
+
+    def __init__(self):
+        self.records = {}           # version -> OTA record
+        self.associated = set()     # versionNumbers
+        self.failAssociate = set()  # versions
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        with self.lock:
+            self.requests.append((method, url))
+            if url.endswith("/oauth/token"):
+                return FakeResponse(200, { "access_token": "token" })
+            if method == "GET" and url.endswith("/exists"):
+                version = url.split("/versions/")[1].split("/")[0]
+                return FakeResponse(200, { "value": version in self.records })
+            if method == "GET" and "/firmwareImages/" in url:
+                found = int(url.rsplit("/", 1)[1]) in self.associated
+                return FakeResponse(200 if found else 404, {})
+            if method == "POST" and url.endswith("/pool"):
+                record = dict(json.loads(kwargs["data"]), id="id-{}".format(len(self.records)),
+                              versionNumber=len(self.records) + 1)
+                self.records[record["version"]] = record
+                return FakeResponse(201, record)
+            if method == "POST" and url.endswith("/binaries"):
+                return FakeResponse(200, { "value": "sha" })
+            if method == "POST" and url.endswith("/moveToRepository"):
+                return FakeResponse(200, { "value": "https://repository/image" })
+            if method == "PUT":
+                return FakeResponse(204, {})
+            if method == "POST" and url.endswith("/firmwareImages"):
+                record = kwargs["json"]
+                if record["version"] in self.failAssociate:
+                    return FakeResponse(500, { "trace": "association failed" })
+                self.associated.add(record["versionNumber"])
+                return FakeResponse(201, record)
+            return FakeResponse(404, { "trace": "not found" })
+
+
+class BatchResumeTest(unittest.TestCase):
+    SETTINGS = ("configFile", "batchFile", "batchJobs", "skip_search_tmpdir",
+                "otaBatchRecordFileName", "commonConfig", "access_token")
+
+    def setUp(self):
+        self.saved = dict((name, getattr(uploader, name)) for name in self.SETTINGS)
+        self.savedRequest = core.request
+        self.directory = tempfile.mkdtemp()
+
+        self.service = FakeOTAService()
+        core.request = self.service.request
+
+        image = os.path.join(self.directory, "hub_update.bin")
+        with open(image, 'wb') as image_file:
+            image_file.write(b"image")
+        config = { "name": "hub", "description": "hub image", "version": "1.0",
+                   "partnerId": "partner", "deviceTypeId": "device-type",
+                   "auth-string": "auth", "username": "user", "userpw": "password",
+                   "imageFiles": { "a": image } }
+        uploader.configFile = os.path.join(self.directory, "partner-ota-conf.json")
+        with open(uploader.configFile, 'w') as config_file:
+            json.dump(config, config_file)
+
+        uploader.batchFile = os.path.join(self.directory, "manifest.json")
+        uploader.batchJobs = 2
+        uploader.skip_search_tmpdir = False
+        uploader.otaBatchRecordFileName = os.path.join(self.directory, "full_ota_batch_record.json")
+
+    def tearDown(self):
+        core.request = self.savedRequest
+        for name, value in self.saved.items():
+            setattr(uploader, name, value)
+        shutil.rmtree(self.directory)
+
+    def run_batch(self, buildNums):
+        """Runs the batch mode, returns its exit code and the records file."""
+        with open(uploader.batchFile, 'w') as manifest_file:
+            json.dump({ "releases": [{ "buildNum": n } for n in buildNums] }, manifest_file)
+        code = 0
+        try:
+            uploader.batchMain()
+        except SystemExit as e:
+            code = e.code
+        with open(uploader.otaBatchRecordFileName) as records_file:
+            return code, json.load(records_file)
+
+    def test_failed_release_resumed(self):
+        self.service.failAssociate.add("1.0.2")
+
+        code, records = self.run_batch(["1", "2"])
+
+        self.assertEqual(code, -16)
+        self.assertEqual(records["1.0.1"]["status"], "published")
+        self.assertEqual(records["1.0.2"]["status"], "failed")
+        self.assertEqual(records["1.0.2"]["exitCode"], -8)
+        record = records["1.0.2"]["record"]
+        self.assertEqual(record["id"], self.service.records["1.0.2"]["id"])
+        self.assertEqual(record["url"], "https://repository/image")
+
+        self.service.failAssociate.clear()
+        del self.service.requests[:]
+        code, records = self.run_batch(["1", "2"])
+
+        self.assertEqual(code, 0)
+        self.assertEqual(records["1.0.1"]["status"], "exists")
+        self.assertEqual(records["1.0.2"]["status"], "published")
+        self.assertEqual(records["1.0.2"]["record"]["id"], record["id"])
+        # resumed from its record rather than created again
+        self.assertEqual(len(self.service.records), 2)
+        self.assertIn(record["versionNumber"], self.service.associated)
+        checked = [url for method, url in self.service.requests
+                   if method == "GET" and "/firmwareImages/" in url]
+        self.assertTrue(any(url.endswith("/{}".format(record["versionNumber"])) for url in checked))
+
+    def test_records_of_other_releases_kept(self):
+        code, records = self.run_batch(["1"])
+        self.assertEqual(code, 0)
+
+        code, records = self.run_batch(["2"])
+
+        self.assertEqual(code, 0)
+        self.assertEqual(sorted(records), ["1.0.1", "1.0.2"])
+        self.assertEqual(records["1.0.1"]["status"], "published")
+        self.assertEqual(records["1.0.2"]["status"], "published")
+
+    def test_existing_release_without_record_skipped(self):
+        self.run_batch(["1"])
+        os.remove(uploader.otaBatchRecordFileName)
+
+        code, records = self.run_batch(["1"])
+
+        self.assertEqual(code, 0)
+        self.assertEqual(records, { "1.0.1": { "status": "exists" } })
+
+
+if __name__ == "__main__":
+    unittest.main()